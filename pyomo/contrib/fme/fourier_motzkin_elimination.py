@@ -10,19 +10,18 @@
 
 from pyomo.core import (Var, Block, Constraint, Param, Set, SetOf, Suffix,
                         Expression, Objective, SortComponents, value,
-                        ConstraintList)
+                        ConstraintList, quicksum)
 from pyomo.core.base import TransformationFactory, _VarData
 from pyomo.core.plugins.transform.hierarchy import Transformation
 from pyomo.common.config import ConfigBlock, ConfigValue, NonNegativeFloat
 from pyomo.common.modeling import unique_component_name
-from pyomo.repn.standard_repn import generate_standard_repn
-from pyomo.common.collections import ComponentMap, ComponentSet
+from pyomo.repn.standard_repn import generate_standard_repn, StandardRepn
+from pyomo.common.collections import ComponentSet, ComponentMap
 from pyomo.opt import TerminationCondition
 
+from itertools import chain
 import logging
 
-from six import iteritems
-
 logger = logging.getLogger('pyomo.contrib.fme')
 NAME_BUFFER = {}
 
@@ -30,17 +29,17 @@ def _check_var_bounds_filter(constraint):
     """Check if the constraint is already implied by the variable bounds"""
     # this is one of our constraints, so we know that it is >=.
     min_lhs = 0
-    for v, coef in iteritems(constraint['map']):
+    for v, coef in constraint['map'].items():
         if coef > 0:
-            if v.lb is None:
-                return True # we don't have var bounds with which to imply the
-                            # constraint...
-            min_lhs += coef*v.lb
+            bound = v.lb
         elif coef < 0:
-            if v.ub is None:
-                return True # we don't have var bounds with which to imply the
-                            # constraint...
-            min_lhs += coef*v.ub
+            bound = v.ub
+        else:
+            continue
+        if bound is None:
+            return True # we don't have var bounds with which to imply the
+                        # constraint...
+        min_lhs += coef*bound
     # we do need value here since we didn't control v.lb and v.ub above.
     if value(min_lhs) >= constraint['lower']:
         return False # constraint implied by var bounds
@@ -265,15 +264,19 @@ class Fourier_Motzkin_Elimination_Transformation(Transformation):
                     "and Objectives may be active on the model." % (obj.name,
                                                                     obj.ctype))
 
+        # We know the standard repns of the variable bound constraints, so we
+        # build them directly rather than calling generate_standard_repn.
         for obj in vars_to_eliminate:
-            if obj.lb is not None:
-                constraints.append({'body': generate_standard_repn(obj),
-                                    'lower': value(obj.lb),
-                                    'map': ComponentMap([(obj, 1)])})
-            if obj.ub is not None:
-                constraints.append({'body': generate_standard_repn(-obj),
-                                    'lower': -value(obj.ub),
-                                    'map': ComponentMap([(obj, -1)])})
+            lb = obj.lb
+            if lb is not None:
+                constraints.append({'body': self._var_bound_repn(obj, 1),
+                                    'lower': value(lb),
+                                    'map': {id(obj): 1}})
+            ub = obj.ub
+            if ub is not None:
+                constraints.append({'body': self._var_bound_repn(obj, -1),
+                                    'lower': -value(ub),
+                                    'map': {id(obj): -1}})
         
         new_constraints = self._fourier_motzkin_elimination( constraints,
                                                              vars_to_eliminate)
@@ -282,7 +285,8 @@ class Fourier_Motzkin_Elimination_Transformation(Transformation):
         for cons in new_constraints:
             if self.constraint_filter is not None:
                 try:
-                    keep = self.constraint_filter(cons)
+                    keep = self.constraint_filter(
+                        self._get_constraint_for_filter(cons))
                 except:
                     logger.error("Problem calling constraint filter callback "
                                  "on constraint with right-hand side %s and "
@@ -305,6 +309,18 @@ class Fourier_Motzkin_Elimination_Transformation(Transformation):
             else:
                 projected_constraints.add(lhs >= lower)
 
+    def _get_constraint_for_filter(self, cons):
+        """Returns the dictionary representation of cons that we give to the
+        constraint_filtering_callback: Internally, 'map' is keyed by id(var),
+        but the callback gets a ComponentMap from the Vars to their
+        coefficients.
+        """
+        id_map = cons['map']
+        return {'lower': cons['lower'],
+                'body': cons['body'],
+                'map': ComponentMap((v, id_map[id(v)]) for v in
+                                    cons['body'].linear_vars)}
+
     def _process_constraint(self, constraint):
         """Transforms a pyomo Constraint object into a list of dictionaries
         representing only >= constraints. That is, if the constraint has both an
@@ -328,7 +344,7 @@ class Fourier_Motzkin_Elimination_Transformation(Transformation):
             if cons_dict['lower'] is not None:
                 # copy the constraint and flip
                 leq_side = {'lower': -upper,
-                            'body': generate_standard_repn(-1.0*body)}
+                            'body': self._negate_repn(std_repn)}
                 self._move_constant_and_add_map(leq_side)
                 constraints_to_add.append(leq_side)
 
@@ -336,11 +352,35 @@ class Fourier_Motzkin_Elimination_Transformation(Transformation):
             else:
                 # just flip the constraint
                 cons_dict['lower'] = -upper
-                cons_dict['body'] = generate_standard_repn(-1.0*body)
+                cons_dict['body'] = self._negate_repn(std_repn)
         self._move_constant_and_add_map(cons_dict)
 
         return constraints_to_add
 
+    def _var_bound_repn(self, var, coef):
+        """Returns the StandardRepn of coef*var"""
+        ans = StandardRepn()
+        ans.linear_vars = (var,)
+        ans.linear_coefs = (coef,)
+        return ans
+
+    def _negate_repn(self, std_repn):
+        """Returns a new StandardRepn for -1.0 times the expression std_repn
+        represents. This saves us from walking the constraint body again just
+        to generate the standard repn of its negation.
+        """
+        ans = StandardRepn()
+        ans.constant = -1.0*std_repn.constant
+        ans.linear_vars = std_repn.linear_vars
+        ans.linear_coefs = tuple(-1.0*coef for coef in std_repn.linear_coefs)
+        ans.quadratic_vars = std_repn.quadratic_vars
+        ans.quadratic_coefs = tuple(-1.0*coef for coef in
+                                    std_repn.quadratic_coefs)
+        ans.nonlinear_vars = std_repn.nonlinear_vars
+        if std_repn.nonlinear_expr is not None:
+            ans.nonlinear_expr = -1.0*std_repn.nonlinear_expr
+        return ans
+
     def _move_constant_and_add_map(self, cons_dict):
         """Takes constraint in dicionary form already in >= form,
         and moves the constant to the RHS
@@ -350,14 +390,15 @@ class Fourier_Motzkin_Elimination_Transformation(Transformation):
         cons_dict['lower'] -= constant
         body.constant = 0
 
-        # store a map of vars to coefficients. We can't use this in place of
+        # store a map of var ids to coefficients. We can't use this in place of
         # standard repn because determinism, but this will save a lot of linear
-        # time searches later. Note also that we will take the value of the
+        # time searches later. (We key on id(var) rather than using a
+        # ComponentMap because this map is queried for every pair of
+        # constraints we combine.) Note also that we will take the value of the
         # coeficient here so that we never have to worry about it again during
         # the transformation.
-        cons_dict['map'] = ComponentMap(zip(body.linear_vars,
-                                            [value(coef) for coef in
-                                             body.linear_coefs]))
+        cons_dict['map'] = {id(v): value(coef) for v, coef in
+                            zip(body.linear_vars, body.linear_coefs)}
 
     def _fourier_motzkin_elimination(self, constraints, vars_to_eliminate):
         """Performs FME on the constraint list in the argument
@@ -366,20 +407,23 @@ class Fourier_Motzkin_Elimination_Transformation(Transformation):
         vars_to_eliminate"""
 
         # We only need to eliminate variables that actually appear in
-        # this set of constraints... Revise our list.
+        # this set of constraints... Revise our list. (We track the vars by id
+        # since that's how they are keyed in the constraints' maps anyway.)
+        ids_to_eliminate = set(id(v) for v in vars_to_eliminate)
         vars_that_appear = []
-        vars_that_appear_set = ComponentSet()
+        vars_that_appear_ids = set()
         for cons in constraints:
             std_repn = cons['body']
             if not std_repn.is_linear():
                 # as long as none of vars_that_appear are in the nonlinear part,
                 # we are actually okay.
-                nonlinear_vars = ComponentSet(v for two_tuple in
-                                        std_repn.quadratic_vars for
-                                        v in two_tuple)
-                nonlinear_vars.update(v for v in std_repn.nonlinear_vars)
+                # (We don't need to collect these in a set first: we only
+                # need to find one that we are supposed to eliminate.)
+                nonlinear_vars = chain(
+                    chain.from_iterable(std_repn.quadratic_vars),
+                    std_repn.nonlinear_vars)
                 for var in nonlinear_vars:
-                    if var in vars_to_eliminate:
+                    if id(var) in ids_to_eliminate:
                         raise RuntimeError("Variable %s appears in a nonlinear "
                                            "constraint. The Fourier-Motzkin "
                                            "Elimination transformation can only "
@@ -387,10 +431,11 @@ class Fourier_Motzkin_Elimination_Transformation(Transformation):
                                            "which only appear linearly." %
                                            var.name)
             for var in std_repn.linear_vars:
-                if var in vars_to_eliminate:
-                    if not var in vars_that_appear_set:
-                        vars_that_appear.append(var)
-                        vars_that_appear_set.add(var)
+                var_id = id(var)
+                if var_id in ids_to_eliminate and \
+                   var_id not in vars_that_appear_ids:
+                    vars_that_appear.append(var)
+                    vars_that_appear_ids.add(var_id)
 
         # we actually begin the recursion here
         total = len(vars_that_appear)
@@ -398,7 +443,8 @@ class Fourier_Motzkin_Elimination_Transformation(Transformation):
         while vars_that_appear:
             # first var we will project out
             the_var = vars_that_appear.pop()
-            logger.warning("Projecting out var %s of %s" % (iteration, total))
+            the_var_id = id(the_var)
+            logger.warning("Projecting out var %s of %s", iteration, total)
             if self.verbose:
                 logger.info("Projecting out %s" %
                             the_var.getname(fully_qualified=True,
@@ -413,8 +459,9 @@ class Fourier_Motzkin_Elimination_Transformation(Transformation):
             waiting_list = []
 
             coefs = []
+            to_scale = []
             for cons in constraints:
-                leaving_var_coef = cons['map'].get(the_var)
+                leaving_var_coef = cons['map'].get(the_var_id)
                 if leaving_var_coef is None or leaving_var_coef == 0:
                     waiting_list.append(cons)
                     if self.verbose:
@@ -438,18 +485,19 @@ class Fourier_Motzkin_Elimination_Transformation(Transformation):
                             self._nonneg_scalar_multiply_linear_constraint(
                                 cons, 1.0/leaving_var_coef))
                 else:
+                    # we need all the coefficients before we can scale, so we
+                    # save the constraints we'll need in the second pass
+                    # along with their (integer) coefficients.
                     coefs.append(self._as_integer(
                         leaving_var_coef,
                         self._get_noninteger_coef_error_message,
-                        (the_var.name, leaving_var_coef)
+                        (the_var, leaving_var_coef)
                     ))
+                    to_scale.append(cons)
             if self.do_integer_arithmetic and len(coefs) > 0:
                 least_common_mult = lcm(coefs)
-                for cons in constraints:
-                    leaving_var_coef = cons['map'].get(the_var)
-                    if leaving_var_coef is None or leaving_var_coef == 0:
-                        continue
-                    to_lcm = least_common_mult // abs(int(leaving_var_coef))
+                for cons, leaving_var_coef in zip(to_scale, coefs):
+                    to_lcm = least_common_mult // abs(leaving_var_coef)
                     if leaving_var_coef < 0:
                         leq_list.append(
                             self._nonneg_scalar_multiply_linear_constraint(
@@ -459,21 +507,55 @@ class Fourier_Motzkin_Elimination_Transformation(Transformation):
                             self._nonneg_scalar_multiply_linear_constraint(
                                 cons, to_lcm))
 
-            constraints = waiting_list
-            for leq in leq_list:
-                for geq in geq_list:
-                    constraints.append( self._add_linear_constraints( leq, geq))
-                    if self.verbose:
-                        cons = constraints[len(constraints)-1]
-                        logger.info("\t%s <= %s" %
-                                    (cons['lower'],
-                                     cons['body'].to_expression()))
+            # The waiting list goes first, so that new constraints which
+            # duplicate one of those are the ones we drop.
+            seen = set()
+            constraints = self._remove_duplicate_constraints(waiting_list,
+                                                             seen)
+            add_linear_constraints = self._add_linear_constraints
+            new_constraints = self._remove_duplicate_constraints(
+                (add_linear_constraints(leq, geq) for leq in leq_list for geq
+                 in geq_list), seen)
+            constraints.extend(new_constraints)
+            if self.verbose:
+                for cons in new_constraints:
+                    logger.info("\t%s <= %s" %
+                                (cons['lower'],
+                                 cons['body'].to_expression()))
 
             iteration += 1
 
         return constraints
 
-    def _get_noninteger_coef_error_message(self, varname, coef):
+    def _remove_duplicate_constraints(self, constraints, seen):
+        """Returns constraints without any linear constraints which are exact
+        duplicates of one earlier in the list (or of one already recorded in
+        seen, which is updated), and without any which are trivially satisfied
+        (that is, constraints of the form 0 >= lower with lower <= 0). Without
+        this, the duplicates would be combined with every constraint they are
+        paired with when we project out the next variable.
+        """
+        ans = []
+        for cons in constraints:
+            body = cons['body']
+            if not body.is_linear():
+                ans.append(cons)
+                continue
+            if not body.linear_vars and cons['lower'] <= 0:
+                # this is trivially satisfied. (If it were infeasible, we
+                # leave it so that we can complain about it later.)
+                continue
+            key = (cons['lower'], tuple(sorted(
+                (var_id, coef) for var_id, coef in cons['map'].items() if
+                coef != 0)))
+            if key in seen:
+                continue
+            seen.add(key)
+            ans.append(cons)
+        return ans
+
+    def _get_noninteger_coef_error_message(self, var, coef):
+        varname = var.name
         return ("The do_integer_arithmetic flag was "
                 "set to True, but the coefficient of "
                 "%s is non-integer within the specified "
@@ -526,29 +608,56 @@ class Fourier_Motzkin_Elimination_Transformation(Transformation):
         tolerance)
         """
         body = cons['body']
+        cons_map = cons['map']
+        if scalar == 1 and not self.do_integer_arithmetic:
+            # This is common (the coefficient of the variable we are
+            # eliminating is often already 1). Multiplying by 1 only changes
+            # the values within zero_tolerance of 0 (which become 0), so we
+            # just snap those in place. (In integer arithmetic mode we still
+            # need to check and convert the coefficients below.)
+            zero_tolerance = self.zero_tolerance
+            coefs = body.linear_coefs
+            for i, coef in enumerate(coefs):
+                if coef != 0 and abs(coef) <= zero_tolerance:
+                    if type(coefs) is not list:
+                        coefs = body.linear_coefs = list(coefs)
+                    coefs[i] = 0
+                    cons_map[id(body.linear_vars[i])] = 0
+            if abs(cons['lower']) <= zero_tolerance:
+                cons['lower'] = 0
+            return cons
         new_coefs = []
-        for i, coef in enumerate(body.linear_coefs):
-            v = body.linear_vars[i]
-            new_coefs.append(self._multiply(
-                scalar, coef, self._get_noninteger_coef_error_message,
-                (v.name, coef)
-            ))
-            # update the map
-            cons['map'][v] = new_coefs[i]
+        if self.do_integer_arithmetic:
+            for v, coef in zip(body.linear_vars, body.linear_coefs):
+                new_coef = self._multiply(
+                    scalar, coef, self._get_noninteger_coef_error_message,
+                    (v, coef))
+                new_coefs.append(new_coef)
+                cons_map[id(v)] = new_coef
+        else:
+            # This is self._multiply, inlined because we call this on every
+            # constraint we project.
+            zero_tolerance = self.zero_tolerance
+            for v, coef in zip(body.linear_vars, body.linear_coefs):
+                new_coef = scalar*coef
+                if abs(new_coef) <= zero_tolerance:
+                    new_coef = 0
+                new_coefs.append(new_coef)
+                cons_map[id(v)] = new_coef
         body.linear_coefs = new_coefs
 
         body.quadratic_coefs = [scalar*coef for coef in body.quadratic_coefs]
         body.nonlinear_expr = scalar*body.nonlinear_expr if \
                               body.nonlinear_expr is not None else None
 
-        # assume scalar >= 0 and constraint only has lower bound
+        # assume scalar >= 0 and constraint only has lower bound (which is
+        # always set: _process_constraint guarantees that)
         lb = cons['lower']
-        if lb is not None:
-            cons['lower'] = self._multiply(
-                scalar, lb,
-                self._nonneg_scalar_multiply_linear_constraint_error_msg,
-                (cons, coef)
-            )
+        cons['lower'] = self._multiply(
+            scalar, lb,
+            self._nonneg_scalar_multiply_linear_constraint_error_msg,
+            (cons, lb)
+        )
         return cons
 
     def _add_linear_constraints_error_msg(self, cons1, cons2):
@@ -569,41 +678,70 @@ class Fourier_Motzkin_Elimination_Transformation(Transformation):
         _nonneg_scalar_multiply_linear_constraint, though it is implemented
         more generally.
         """
-        ans = {'lower': None, 'body': None, 'map': ComponentMap()}
         cons1_body = cons1['body']
         cons2_body = cons2['body']
 
-        # Need this to be both deterministic and to account for the fact that
-        # Vars aren't hashable.
-        all_vars = list(cons1_body.linear_vars)
-        seen = ComponentSet(all_vars)
-        for v in cons2_body.linear_vars:
-            if v not in seen:
-                all_vars.append(v)
-
-        expr = 0
-        for var in all_vars:
-            coef = self._add(
-                cons1['map'].get(var, 0), cons2['map'].get(var, 0),
-                self._add_linear_constraints_error_msg, (cons1, cons2))
-            ans['map'][var] = coef
-            expr += coef*var
-
-        # deal with nonlinear stuff if there is any
-        for cons in [cons1_body, cons2_body]:
-            if cons.nonlinear_expr is not None:
-                expr += cons.nonlinear_expr
-            expr += sum(coef*v1*v2 for (coef, (v1, v2)) in
-                        zip(cons.quadratic_coefs, cons.quadratic_vars))
-
-        ans['body'] = generate_standard_repn(expr)
+        cons1_map = cons1['map']
+        cons2_map = cons2['map']
+        ans_map = {}
+        linear_vars = []
+        linear_coefs = []
+        do_integer_arithmetic = self.do_integer_arithmetic
+        zero_tolerance = self.zero_tolerance
+        # We merge the two constraints in a single pass over the vars of cons1
+        # followed by those of cons2 (which keeps this deterministic).
+        seen = set()
+        for var in chain(cons1_body.linear_vars, cons2_body.linear_vars):
+            var_id = id(var)
+            if var_id in seen:
+                continue
+            seen.add(var_id)
+            if do_integer_arithmetic:
+                coef = self._add(
+                    cons1_map.get(var_id, 0), cons2_map.get(var_id, 0),
+                    self._add_linear_constraints_error_msg, (cons1, cons2))
+            else:
+                # This is self._add, inlined because this is the innermost
+                # loop of the transformation.
+                coef = cons1_map.get(var_id, 0) + cons2_map.get(var_id, 0)
+                if abs(coef) <= zero_tolerance:
+                    coef = 0
+            # We only keep the nonzero coefficients, both in the body
+            # (generate_standard_repn would drop the 0 coefficients too) and in
+            # the map. In particular, this means that the variables we have
+            # already projected out don't pile up in the maps of the new
+            # constraints, which would make every subsequent addition and
+            # duplicate check touch them again.
+            if coef != 0:
+                ans_map[var_id] = coef
+                linear_vars.append(var)
+                linear_coefs.append(coef)
+
+        if cons1_body.is_linear() and cons2_body.is_linear():
+            # This is the usual case, and we already know the standard repn of
+            # the sum, so we build it directly rather than constructing an
+            # expression only to have generate_standard_repn take it apart
+            # again.
+            body = StandardRepn()
+            body.linear_vars = tuple(linear_vars)
+            body.linear_coefs = tuple(linear_coefs)
+        else:
+            terms = [coef*var for coef, var in zip(linear_coefs, linear_vars)]
+            # deal with nonlinear stuff
+            for cons in [cons1_body, cons2_body]:
+                if cons.nonlinear_expr is not None:
+                    terms.append(cons.nonlinear_expr)
+                terms.extend(coef*v1*v2 for (coef, (v1, v2)) in
+                             zip(cons.quadratic_coefs, cons.quadratic_vars))
+
+            body = generate_standard_repn(quicksum(terms, linear=False))
 
         # upper is None and lower exists, so this gets the constant
-        ans['lower'] = self._add(
+        lower = self._add(
             cons1['lower'], cons2['lower'],
             self._add_linear_constraints_error_msg, (cons1, cons2))
 
-        return ans
+        return {'lower': lower, 'body': body, 'map': ans_map}
 
     def post_process_fme_constraints(self, m, solver_factory,
                                      projected_constraints=None, tolerance=0):
@@ -292,6 +292,27 @@ class TestFourierMotzkinElimination(unittest.TestCase):
             "Problem calling constraint filter callback "
             "on constraint with right-hand side -1.0 and body:*")
 
+    def test_constraint_filtering_callback_map_keyed_by_var(self):
+        m = self.makeModel()
+        seen = []
+        def callback(cons):
+            seen.append(cons)
+            return True
+        TransformationFactory('contrib.fourier_motzkin_elimination').apply_to(
+            m,
+            vars_to_eliminate=m.lamb,
+            constraint_filtering_callback=callback)
+
+        self.assertEqual(len(seen), 7)
+        for cons in seen:
+            body = cons['body']
+            self.assertEqual(len(cons['map']), len(body.linear_vars))
+            for v, coef in zip(body.linear_vars, body.linear_coefs):
+                self.assertIn(v, cons['map'])
+                self.assertEqual(cons['map'].get(v, 0), coef)
+            for v in cons['map']:
+                self.assertIn(v, ComponentSet([m.x, m.y, m.u[1], m.u[2]]))
+
     def test_combine_three_inequalities_and_flatten_blocks(self):
         m = ConcreteModel()
         m.x = Var()
@@ -525,8 +546,8 @@ class TestFourierMotzkinElimination(unittest.TestCase):
         constraints = m._pyomo_contrib_fme_transformation.projected_constraints
         # we of course get tremendous amounts of garbage, but we make sure that
         # what should be here is:
-        self.check_hull_projected_constraints(m, constraints, [16, 11, 57, 59,
-                                                               46, 48, 27, 1, 2,
+        self.check_hull_projected_constraints(m, constraints, [15, 10, 46, 47,
+                                                               40, 42, 22, 1, 2,
                                                                4, 5])
         # and when we filter, it's still there.
         constraints = filtered._pyomo_contrib_fme_transformation.\
@@ -763,6 +784,122 @@ class TestFourierMotzkinElimination(unittest.TestCase):
         self.assertIs(repn.linear_vars[0], m.y)
         self.assertEqual(repn.linear_coefs[0], 3)
 
+    def make_model_with_duplicate_and_trivial_constraints(self):
+        m = ConcreteModel()
+        m.x = Var()
+        m.y = Var()
+        m.c1 = Constraint(expr=m.x >= m.y)
+        m.c2 = Constraint(expr=m.x <= 4)
+        # After scaling, this duplicates c2
+        m.c3 = Constraint(expr=2*m.x <= 8)
+        # Combined with c1, this gives 0 >= -10
+        m.c4 = Constraint(expr=m.x <= m.y + 10)
+        # These don't involve x, and are duplicates of each other
+        m.c5 = Constraint(expr=m.y >= 1)
+        m.c6 = Constraint(expr=m.y >= 1)
+
+        return m
+
+    def test_duplicate_and_trivial_constraints_removed(self):
+        m = self.make_model_with_duplicate_and_trivial_constraints()
+        fme = TransformationFactory('contrib.fourier_motzkin_elimination')
+        fme.apply_to(m, vars_to_eliminate=m.x,
+                     constraint_filtering_callback=None)
+
+        constraints = m._pyomo_contrib_fme_transformation.projected_constraints
+        self.assertEqual(len(constraints), 2)
+
+        # y >= 1 (only once)
+        cons = constraints[1]
+        self.assertEqual(value(cons.lower), 1)
+        self.assertIs(cons.body, m.y)
+        self.assertIsNone(cons.upper)
+
+        # -y >= -4 (only once, and the trivial constraint from c1 and c4 is
+        # gone)
+        cons = constraints[2]
+        self.assertEqual(value(cons.lower), -4)
+        self.assertIsNone(cons.upper)
+        repn = generate_standard_repn(cons.body)
+        self.assertTrue(repn.is_linear())
+        self.assertEqual(len(repn.linear_vars), 1)
+        self.assertIs(repn.linear_vars[0], m.y)
+        self.assertEqual(repn.linear_coefs[0], -1)
+
+    def test_verbose_output_only_logs_new_constraints(self):
+        m = self.make_model_with_duplicate_and_trivial_constraints()
+        fme = TransformationFactory('contrib.fourier_motzkin_elimination')
+        log = StringIO()
+        with LoggingIntercept(log, 'pyomo.contrib.fme', logging.INFO):
+            fme.apply_to(m, vars_to_eliminate=m.x,
+                         constraint_filtering_callback=None, verbose=True)
+
+        lines = log.getvalue().splitlines()
+        new = lines[lines.index("New constraints are:") + 1:]
+        # The two copies of y >= 1 from the waiting list, and then the one new
+        # constraint that survives
+        self.assertEqual(len(new), 3)
+        self.assertEqual(new[0], "\t1.0 <= y")
+        self.assertEqual(new[1], "\t1.0 <= y")
+        self.assertEqual(new[2], "\t-4.0 <= - y")
+
+    def test_values_within_zero_tolerance_snapped_when_scalar_is_1(self):
+        m = ConcreteModel()
+        m.x = Var()
+        m.y = Var()
+        m.z = Var()
+        # the coefficient of x is already 1 in all of these, but the lower
+        # bound of c1 and the coefficient of z in c2 are within zero_tolerance
+        # of 0
+        m.c1 = Constraint(expr=m.x - m.y >= 1e-10)
+        m.c2 = Constraint(expr=m.x - 2*m.y + 1e-10*m.z >= 1)
+        m.c3 = Constraint(expr=m.x <= 5)
+
+        fme = TransformationFactory('contrib.fourier_motzkin_elimination')
+        fme.apply_to(m, vars_to_eliminate=m.x,
+                     constraint_filtering_callback=None, zero_tolerance=1e-8)
+
+        constraints = m._pyomo_contrib_fme_transformation.projected_constraints
+        self.assertEqual(len(constraints), 2)
+
+        # -y >= -5
+        cons = constraints[1]
+        self.assertEqual(value(cons.lower), -5)
+        self.assertIsNone(cons.upper)
+        repn = generate_standard_repn(cons.body)
+        self.assertTrue(repn.is_linear())
+        self.assertEqual(len(repn.linear_vars), 1)
+        self.assertIs(repn.linear_vars[0], m.y)
+        self.assertEqual(repn.linear_coefs[0], -1)
+
+        # -2y >= -4
+        cons = constraints[2]
+        self.assertEqual(value(cons.lower), -4)
+        self.assertIsNone(cons.upper)
+        repn = generate_standard_repn(cons.body)
+        self.assertTrue(repn.is_linear())
+        self.assertEqual(len(repn.linear_vars), 1)
+        self.assertIs(repn.linear_vars[0], m.y)
+        self.assertEqual(repn.linear_coefs[0], -2)
+
+    def test_infeasible_constraint_not_removed(self):
+        m = ConcreteModel()
+        m.x = Var()
+        m.y = Var()
+        m.cons1 = Constraint(expr=m.x + m.y >= 6)
+        m.cons2 = Constraint(expr=m.x + m.y <= 2)
+        # duplicate of cons2
+        m.cons3 = Constraint(expr=2*m.x + 2*m.y <= 4)
+
+        self.assertRaisesRegexp(
+            RuntimeError,
+            "Fourier-Motzkin found the model is infeasible!",
+            TransformationFactory('contrib.fourier_motzkin_elimination').\
+            apply_to,
+            m,
+            vars_to_eliminate=m.x,
+            constraint_filtering_callback=None)
+
     def test_numerical_instability_almost_canceling(self):
         # It's possible that we get almost-but-not-quite zero on the variable
         # being eliminated when we are doing this with floating point
@@ -14,16 +14,15 @@ Cutting plane-based GDP reformulation.
 Implements a general cutting plane-based reformulation for linear and
 convex GDPs.
 """
-from __future__ import division
-
 from pyomo.common.config import (ConfigBlock, ConfigValue, PositiveFloat,
                                  NonNegativeFloat, PositiveInt, In)
 from pyomo.common.modeling import unique_component_name
 from pyomo.core import ( Any, Block, Constraint, Objective, Param, Var,
                          SortComponents, Transformation, TransformationFactory,
                          value, NonNegativeIntegers, Reals, NonNegativeReals,
-                         Suffix, ComponentMap )
+                         Suffix, quicksum )
 from pyomo.core.expr import differentiate
+from pyomo.core.expr.visitor import identify_variables
 from pyomo.common.collections import ComponentSet
 from pyomo.opt import SolverFactory
 from pyomo.repn import generate_standard_repn
@@ -35,8 +34,7 @@ from pyomo.gdp.util import ( verify_successful_solve, NORMAL,
 from pyomo.contrib.fme.fourier_motzkin_elimination import \
     Fourier_Motzkin_Elimination_Transformation
 
-from six import iteritems
-
+from itertools import chain
 import logging
 
 logger = logging.getLogger('pyomo.gdp.cuttingplane')
@@ -65,44 +63,56 @@ def _constraint_tight(model, constraint, TOL):
     """
     val = value(constraint.body)
     ans = [0, 0]
-    if constraint.lower is not None:
-        if val - value(constraint.lower) <= TOL:
-            # tight or in violation of LB
-            ans[0] -= 1
+    lower = constraint.lower
+    if lower is not None and val - value(lower) <= TOL:
+        # tight or in violation of LB
+        ans[0] = -1
 
-    if constraint.upper is not None:
-        if value(constraint.upper) - val <= TOL:
-            # tight or in violation of UB
-            ans[1] += 1
+    upper = constraint.upper
+    if upper is not None and value(upper) - val <= TOL:
+        # tight or in violation of UB
+        ans[1] = 1
 
     return ans
 
 def _get_linear_approximation_expr(normal_vec, point):
     """Returns constraint linearly approximating constraint normal to normal_vec
     at point"""
-    body = 0
-    for coef, v in zip(point, normal_vec):
-        body -= coef*v
-    return body >= -sum(normal_vec[idx]*v.value for (idx, v) in
-                       enumerate(point))
+    # We compute the terms of the body and the (numeric) right-hand side in
+    # the same pass over the normal vector.
+    body = []
+    rhs = 0
+    for coef, v in zip(normal_vec, point):
+        body.append(-coef*v)
+        rhs -= coef*v.value
+    return quicksum(body, linear=True) >= rhs
 
 def _precompute_potentially_useful_constraints(transBlock_rHull,
                                                disaggregated_vars):
     instance_rHull = transBlock_rHull.model()
     constraints = transBlock_rHull.constraints_for_FME = []
+    # We check every var of every constraint against this, so we use a set of
+    # ids rather than asking the ComponentSet.
+    disaggregated_var_ids = set(id(v) for v in disaggregated_vars)
     for constraint in instance_rHull.component_data_objects(
             Constraint,
             active=True,
             descend_into=Block,
             sort=SortComponents.deterministic):
         # we don't care about anything that does not involve at least one
-        # disaggregated variable.
+        # disaggregated variable. For the ones we do care about, we also save
+        # which disaggregated variables they involve, so that we only project
+        # out the ones that actually appear in the tight constraints, and
+        # whether or not they are linear.
         repn = generate_standard_repn(constraint.body)
-        for v in repn.linear_vars + repn.quadratic_vars + repn.nonlinear_vars:
-            # ESJ: This is why disaggregated_vars is a ComponentSet
-            if v in disaggregated_vars:
-                constraints.append(constraint)
-                break
+        cons_disaggregated_var_ids = set(
+            id(v) for v in chain(repn.linear_vars,
+                                 chain.from_iterable(repn.quadratic_vars),
+                                 repn.nonlinear_vars)
+            if id(v) in disaggregated_var_ids)
+        if cons_disaggregated_var_ids:
+            constraints.append((constraint, cons_disaggregated_var_ids,
+                                repn.is_linear()))
 
 def create_cuts_fme(transBlock_rHull, var_info, hull_to_bigm_map,
                     rBigM_linear_constraints, rHull_vars, disaggregated_vars,
@@ -144,8 +154,9 @@ def create_cuts_fme(transBlock_rHull, var_info, hull_to_bigm_map,
     instance_rHull = transBlock_rHull.model()
     # In the first iteration, we will compute a list of constraints that could
     # ever be interesting: Everything that involves at least one disaggregated
-    # variable.
-    if transBlock_rHull.component("constraints_for_FME") is None:
+    # variable. (Note that this list is not a component, so we can't use
+    # component() to check if we have already done this.)
+    if not hasattr(transBlock_rHull, "constraints_for_FME"):
         _precompute_potentially_useful_constraints( transBlock_rHull,
                                                     disaggregated_vars)
 
@@ -154,23 +165,36 @@ def create_cuts_fme(transBlock_rHull, var_info, hull_to_bigm_map,
         NonNegativeIntegers)
     conslist.construct()
     something_interesting = False
-    for constraint in transBlock_rHull.constraints_for_FME:
+    tight_disaggregated_var_ids = set()
+    for constraint, cons_disaggregated_var_ids, is_linear in \
+        transBlock_rHull.constraints_for_FME:
+        if is_linear and constraint.equality:
+            # An equality is always tight on at least one side (for example,
+            # the disaggregation constraints), so there is no need to check,
+            # and since it's linear we only need to add it once.
+            something_interesting = True
+            tight_disaggregated_var_ids.update(cons_disaggregated_var_ids)
+            conslist[len(conslist)] = constraint.expr
+            continue
         multipliers = _constraint_tight(instance_rHull, constraint,
                                         constraint_tolerance)
         for multiplier in multipliers:
             if multiplier:
                 something_interesting = True
-                f = constraint.body
-                firstDerivs = differentiate(f, wrt_list=rHull_vars)
-                normal_vec = [multiplier*value(_) for _ in firstDerivs]
-                # check if constraint is linear
-                if f.polynomial_degree() == 1:
+                tight_disaggregated_var_ids.update(cons_disaggregated_var_ids)
+                if is_linear:
                     conslist[len(conslist)] = constraint.expr
                 else: 
+                    f = constraint.body
                     # we will use the linear approximation of this constraint at
-                    # x_hat
+                    # x_hat. The derivatives with respect to any variable not
+                    # in the constraint are 0, so we only differentiate with
+                    # respect to the ones that are.
+                    f_vars = list(identify_variables(f, include_fixed=False))
+                    firstDerivs = differentiate(f, wrt_list=f_vars)
+                    normal_vec = [multiplier*value(_) for _ in firstDerivs]
                     conslist[len(conslist)] = _get_linear_approximation_expr(
-                        normal_vec, rHull_vars)
+                        normal_vec, f_vars)
 
     # NOTE: we now have all the tight Constraints (in the pyomo sense of the
     # word "Constraint"), but we are missing some variable bounds. The ones for
@@ -183,17 +207,24 @@ def create_cuts_fme(transBlock_rHull, var_info, hull_to_bigm_map,
     if not something_interesting:
         return None
 
+    # We only need to project out the disaggregated variables which appear in
+    # the tight constraints: Any others would only appear in their own bound
+    # constraints. (We keep the original order of disaggregated_vars so that
+    # the projection is deterministic.)
+    vars_to_eliminate = [v for v in disaggregated_vars if id(v) in
+                         tight_disaggregated_var_ids]
+
     tight_constraints.construct()
     logger.info("Calling FME transformation on %s constraints to eliminate"
-                " %s variables" % (len(tight_constraints.constraints),
-                                   len(disaggregated_vars)))
+                " %s variables", len(tight_constraints.constraints),
+                len(vars_to_eliminate))
     TransformationFactory('contrib.fourier_motzkin_elimination').\
-        apply_to(tight_constraints, vars_to_eliminate=disaggregated_vars,
+        apply_to(tight_constraints, vars_to_eliminate=vars_to_eliminate,
                  zero_tolerance=zero_tolerance,
                  do_integer_arithmetic=integer_arithmetic,
                  projected_constraints_name="fme_constraints")
     fme_results = tight_constraints.fme_constraints
-    projected_constraints = [cons for i, cons in iteritems(fme_results)]
+    projected_constraints = list(fme_results.values())
 
     # we created these constraints with the variables from rHull. We
     # actually need constraints for BigM and rBigM now!
@@ -210,20 +241,24 @@ def create_cuts_fme(transBlock_rHull, var_info, hull_to_bigm_map,
     for i, cut in enumerate(cuts):
         # x* is still in rBigM, so we can just remove this constraint if it
         # is satisfied at x*
-        logger.info("FME: Post-processing cut %s" % cut)
-        if value(cut):
+        logger.info("FME: Post-processing cut %s", cut)
+        # We know cut is lb <= expr (FME only creates constraints of that
+        # form, and unpacking the args would complain if it didn't), so it is
+        # satisfied at x* exactly when this is nonpositive. We only evaluate
+        # each side once, and use the result both to check that and to score
+        # the cut.
+        lb, expr = cut.args
+        cut_off = value(lb) - value(expr)
+        if cut_off <= 0:
             logger.info("FME:\t Doesn't cut off x*")
             continue
         # we have found a constraint which cuts of x* by some convincing amount
         # and is not already in rBigM. 
         cuts_to_keep.append(i)
-        # We know cut is lb <= expr and that it's violated
-        assert len(cut.args) == 2
-        cut_off = value(cut.args[0]) - value(cut.args[1])
         if cut_off > cut_threshold and cut_off > best:
             best = cut_off
             best_cut = cut
-            logger.info("FME:\t New best cut: Cuts off x* by %s." % best)
+            logger.info("FME:\t New best cut: Cuts off x* by %s.", best)
 
     # NOTE: this is not used right now, but it's not hard to imagine a world in
     # which we would want to keep multiple cuts from FME, so leaving it in for
@@ -273,10 +308,13 @@ def create_cuts_normal_vector(transBlock_rHull, var_info, hull_to_bigm_map,
     constraint_tolerance: Ignored by this callback (specifies when constraints
                           are considered tight in FME)
     """
-    cutexpr = 0
+    # build the cut expression as a single sum
+    cutexpr_terms = []
     if norm == 2:
         for x_rbigm, x_hull, x_star in var_info:
-            cutexpr += (x_hull.value - x_star.value)*(x_rbigm - x_hull.value)
+            x_hull_val = x_hull.value
+            cutexpr_terms.append((x_hull_val - x_star.value)*
+                                 (x_rbigm - x_hull_val))
     elif norm == float('inf'):
         duals = transBlock_rHull.model().dual
         if len(duals) == 0:
@@ -284,15 +322,17 @@ def create_cuts_normal_vector(transBlock_rHull, var_info, hull_to_bigm_map,
                             "To use the infinity norm and the "
                             "create_cuts_normal_vector method, you must use "
                             "a solver which provides dual information.")
+        inf_norm_linearization = transBlock_rHull.inf_norm_linearization
         i = 0
         for x_rbigm, x_hull, x_star in var_info:
             # ESJ: We wrote this so duals will be nonnegative
-            mu_plus = value(duals[transBlock_rHull.inf_norm_linearization[i]])
-            mu_minus = value(duals[transBlock_rHull.inf_norm_linearization[i+1]])
+            mu_plus = value(duals[inf_norm_linearization[i]])
+            mu_minus = value(duals[inf_norm_linearization[i+1]])
             assert mu_plus >= 0
             assert mu_minus >= 0
-            cutexpr += (mu_plus - mu_minus)*(x_rbigm - x_hull.value)
+            cutexpr_terms.append((mu_plus - mu_minus)*(x_rbigm - x_hull.value))
             i += 2
+    cutexpr = quicksum(cutexpr_terms)
 
     # make sure we're cutting off x* by enough.
     if value(cutexpr) < -cut_threshold:
@@ -324,7 +364,7 @@ def back_off_constraint_with_calculated_cut_violation(cut, transBlock_rHull,
          solve.
     """
     instance_rHull = transBlock_rHull.model()
-    logger.info("Post-processing cut: %s" % cut.expr)
+    logger.info("Post-processing cut: %s", cut.expr)
     # Take a constraint. We will solve a problem maximizing its violation
     # subject to rHull. We will add some user-specified tolerance to that
     # violation, and then add that much padding to it if it can be violated.
@@ -349,7 +389,7 @@ def back_off_constraint_with_calculated_cut_violation(cut, transBlock_rHull,
     # we're minimizing, val is <= 0
     val = value(transBlock_rHull.infeasibility_objective) - TOL
     if val <= 0:
-        logger.info("\tBacking off cut by %s" % val)
+        logger.info("\tBacking off cut by %s", val)
         cut._body += abs(val)
     # else there is nothing to do: restore the objective
     transBlock_rHull.del_component(transBlock_rHull.infeasibility_objective)
@@ -687,6 +727,11 @@ class CuttingPlane_Transformation(Transformation):
     ))
     def __init__(self):
         super(CuttingPlane_Transformation, self).__init__()
+        # The other transformations we use in every call to apply_to
+        self._bigm = TransformationFactory('gdp.bigm')
+        self._hull = TransformationFactory('gdp.hull')
+        self._relax_integrality = TransformationFactory(
+            'core.relax_integer_vars')
 
     def _apply_to(self, instance, bigM=None, **kwds):
         original_log_level = logger.level
@@ -714,8 +759,7 @@ class CuttingPlane_Transformation(Transformation):
                                           transBlockName)
 
             # restore integrality
-            TransformationFactory('core.relax_integer_vars').apply_to(instance,
-                                                                      undo=True)
+            self._relax_integrality.apply_to(instance, undo=True)
         finally:
             del self._config
             del self.verbose
@@ -731,10 +775,12 @@ class CuttingPlane_Transformation(Transformation):
         # We store a list of all vars so that we can efficiently
         # generate maps among the subproblems
 
-        transBlock.all_vars = list(v for v in instance.component_data_objects(
+        # (Note that the order matters here: We use it to match up the
+        # variables on the different subproblems.)
+        transBlock.all_vars = [v for v in instance.component_data_objects(
             Var,
             descend_into=(Block, Disjunct),
-            sort=SortComponents.deterministic) if not v.is_fixed())
+            sort=SortComponents.deterministic) if not v.fixed]
 
         # we'll store all the cuts we add together
         nm = self._config.cuts_name
@@ -750,9 +796,9 @@ class CuttingPlane_Transformation(Transformation):
             cuts_obj = instance.component(nm)
 
         # get bigM and hull relaxations
-        bigMRelaxation = TransformationFactory('gdp.bigm')
-        hullRelaxation = TransformationFactory('gdp.hull')
-        relaxIntegrality = TransformationFactory('core.relax_integer_vars')
+        bigMRelaxation = self._bigm
+        hullRelaxation = self._hull
+        relaxIntegrality = self._relax_integrality
 
         #
         # Generate the Hull relaxation (used for the separation
@@ -822,17 +868,16 @@ class CuttingPlane_Transformation(Transformation):
 
     def _get_disaggregated_vars(self, hull):
         disaggregatedVars = ComponentSet()
-        hull_xform = TransformationFactory('gdp.hull')
         for disjunction in hull.component_data_objects( Disjunction,
                                                         descend_into=(Disjunct,
                                                                       Block)):
             for disjunct in disjunction.disjuncts:
                 if disjunct.transformation_block is not None:
                     transBlock = disjunct.transformation_block()
-                    for v in transBlock.disaggregatedVars.\
-                        component_data_objects(Var):
-                        disaggregatedVars.add(v)
-                
+                    disaggregatedVars.update(
+                        transBlock.disaggregatedVars.component_data_objects(
+                            Var))
+
         return disaggregatedVars
 
     def _get_rBigM_obj_and_constraints(self, instance_rBigM):
@@ -905,7 +950,6 @@ class CuttingPlane_Transformation(Transformation):
 
         hull_to_bigm_map = self._create_hull_to_bigm_substitution_map(var_info)
         bigm_to_hull_map = self._create_bigm_to_hull_substition_map(var_info)
-        xhat = ComponentMap()
 
         while (improving):
             # solve rBigM, solution is xstar
@@ -931,13 +975,15 @@ class CuttingPlane_Transformation(Transformation):
                 self._add_separation_objective(var_info, transBlock_rHull)
             
             # copy over xstar
-            logger.info("x* is:")
             for x_rbigm, x_hull, x_star in var_info:
                 if not x_rbigm.stale:
-                    x_star.value = x_rbigm.value
+                    val = x_rbigm.value
+                    x_star.value = val
                     # initialize the X values
-                    x_hull.value = x_rbigm.value    
-                if self.verbose:
+                    x_hull.value = val
+            if self.verbose:
+                logger.info("x* is:")
+                for x_rbigm, x_hull, x_star in var_info:
                     logger.info("\t%s = %s" % 
                                 (x_rbigm.getname(fully_qualified=True,
                                                  name_buffer=NAME_BUFFER),
@@ -964,12 +1010,12 @@ class CuttingPlane_Transformation(Transformation):
             logger.warning("separation problem objective value: %s" %
                            value(transBlock_rHull.separation_objective))
 
-            # save xhat to initialize rBigM with in the next iteration
+            # save xhat to initialize rBigM with in the next iteration (in
+            # the same order as var_info)
+            xhat = [value(x_hull) for x_rbigm, x_hull, x_star in var_info]
             if self.verbose:
                 logger.info("xhat is: ")
-            for x_rbigm, x_hull, x_star in var_info:
-                xhat[x_rbigm] = value(x_hull)
-                if self.verbose:
+                for x_rbigm, x_hull, x_star in var_info:
                     logger.info("\t%s = %s" % 
                                 (x_hull.getname(fully_qualified=True,
                                                 name_buffer=NAME_BUFFER), 
@@ -1028,8 +1074,8 @@ class CuttingPlane_Transformation(Transformation):
             prev_obj = rBigM_objVal
 
             # Initialize rbigm with xhat (for the next iteration)
-            for x_rbigm, x_hull, x_star in var_info:
-                x_rbigm.value = xhat[x_rbigm]
+            for (x_rbigm, x_hull, x_star), val in zip(var_info, xhat):
+                x_rbigm.value = val
 
     def _add_transformation_block(self, instance):
         # creates transformation block with a unique name based on name, adds it
@@ -1054,13 +1100,17 @@ class CuttingPlane_Transformation(Transformation):
         for o in transBlock_rHull.model().component_data_objects(Objective):
             o.deactivate()
         norm = self._config.norm
-        to_delete = []
+        # the entries of var_info we will keep
+        kept_var_info = []
 
         if norm == 2:
-            obj_expr = 0
-            for i, (x_rbigm, x_hull, x_star) in enumerate(var_info):
+            # build the objective as a single sum
+            obj_terms = []
+            for info in var_info:
+                x_rbigm, x_hull, x_star = info
                 if not x_rbigm.stale:
-                    obj_expr += (x_hull - x_star)**2
+                    obj_terms.append((x_hull - x_star)**2)
+                    kept_var_info.append(info)
                 else:
                     if self.verbose:
                         logger.info("The variable %s will not be included in "
@@ -1068,19 +1118,21 @@ class CuttingPlane_Transformation(Transformation):
                                     "the rBigM solve." % x_rbigm.getname(
                                         fully_qualified=True,
                                         name_buffer=NAME_BUFFER))
-                    to_delete.append(i)
+            obj_expr = quicksum(obj_terms, linear=False)
         elif norm == float('inf'):
             u = transBlock_rHull.u = Var(domain=NonNegativeReals)
             inf_cons = transBlock_rHull.inf_norm_linearization = Constraint(
                 NonNegativeIntegers)
             i = 0
-            for j, (x_rbigm, x_hull, x_star) in enumerate(var_info):
+            for info in var_info:
+                x_rbigm, x_hull, x_star = info
                 if not x_rbigm.stale:
                     # NOTE: these are written as >= constraints so that we know
                     # the duals will come back nonnegative.
                     inf_cons[i] = u  - x_hull >= - x_star
                     inf_cons[i+1] = u + x_hull >= x_star
                     i += 2
+                    kept_var_info.append(info)
                 else:
                     if self.verbose:
                         logger.info("The variable %s will not be included in "
@@ -1088,15 +1140,15 @@ class CuttingPlane_Transformation(Transformation):
                                     "the rBigM solve." % x_rbigm.getname(
                                         fully_qualified=True,
                                         name_buffer=NAME_BUFFER))
-                    to_delete.append(j)
             # we'll need the duals of these to get the subgradient
             self._add_dual_suffix(transBlock_rHull.model())
             obj_expr = u
         
-        # delete the unneeded x_stars so that we don't add cuts involving
-        # useless variables later.
-        for i in sorted(to_delete, reverse=True):
-            del var_info[i]
+        # drop the unneeded x_stars so that we don't add cuts involving
+        # useless variables later. (We modify var_info in place since the
+        # caller holds on to it, but we rebuild it in one go rather than
+        # deleting entries one at a time.)
+        var_info[:] = kept_var_info
 
         # add separation objective to transformation block
         transBlock_rHull.separation_objective = Objective(expr=obj_expr)
@@ -13,7 +13,8 @@ import pyutilib.th as unittest
 from pyomo.environ import (ConcreteModel, Var, Constraint, Objective, Block,
                            TransformationFactory, value, maximize, Suffix)
 from pyomo.gdp import Disjunct, Disjunction, GDP_Error
-from pyomo.gdp.plugins.cuttingplane import create_cuts_fme 
+from pyomo.gdp.plugins.cuttingplane import create_cuts_fme, do_not_tighten
+from pyomo.common.log import LoggingIntercept
 
 import pyomo.opt
 import pyomo.gdp.tests.models as models
@@ -21,6 +22,7 @@ from pyomo.repn import generate_standard_repn
 from pyomo.gdp.tests.common_tests import diff_apply_to_and_create_using
 
 from six import StringIO
+import logging
 
 solvers = pyomo.opt.check_available_solvers('ipopt', 'gurobi')
 
@@ -557,6 +559,134 @@ class TwoTermDisj(unittest.TestCase):
         self.assertIs(repn.linear_vars[1], m.x)
         self.assertEqual(repn.linear_coefs[1], -1)
 
+class CreateCutsFME(unittest.TestCase):
+    """Tests for create_cuts_fme that don't need a solver: We set up the
+    subproblems ourselves and put the separation problem solution in place by
+    hand."""
+    def setup_subproblems(self):
+        m = models.makeTwoTermDisj_boxes()
+        cuttingplane = TransformationFactory('gdp.cuttingplane')
+        cuttingplane._config = cuttingplane.CONFIG()
+        cuttingplane.verbose = False
+        (instance_rBigM, cuts_obj, instance_rHull, var_info,
+         transBlockName) = cuttingplane._setup_subproblems(m, None,
+                                                            do_not_tighten)
+        self.cuttingplane = cuttingplane
+        self.instance_rBigM = instance_rBigM
+        self.instance_rHull = instance_rHull
+        self.var_info = var_info
+        self.transBlock_rHull = instance_rHull.component(transBlockName)
+        self.disaggregated_vars = cuttingplane._get_disaggregated_vars(
+            instance_rHull)
+
+        # x* (from rBigM) is (2, 2) with d[0] selected
+        instance_rBigM.x.value = 2
+        instance_rBigM.y.value = 2
+        instance_rBigM.d[0].indicator_var.value = 1
+        instance_rBigM.d[1].indicator_var.value = 0
+        for x_rbigm, x_hull, x_star in var_info:
+            x_star.value = x_rbigm.value
+
+        # xhat (from the separation problem)
+        hull = TransformationFactory('gdp.hull')
+        rHull = instance_rHull
+        rHull.d[0].indicator_var.value = 0.5
+        rHull.d[1].indicator_var.value = 0.5
+        hull.get_disaggregated_var(rHull.x, rHull.d[0]).value = 1
+        hull.get_disaggregated_var(rHull.y, rHull.d[0]).value = 1.5
+        hull.get_disaggregated_var(rHull.x, rHull.d[1]).value = 1.5
+        hull.get_disaggregated_var(rHull.y, rHull.d[1]).value = 1
+        rHull.x.value = 2.5
+        rHull.y.value = 2.5
+
+    def create_cuts(self):
+        cuttingplane = self.cuttingplane
+        log = StringIO()
+        with LoggingIntercept(log, 'pyomo.gdp.cuttingplane', logging.INFO):
+            cuts = create_cuts_fme(
+                self.transBlock_rHull, self.var_info,
+                cuttingplane._create_hull_to_bigm_substitution_map(
+                    self.var_info),
+                cuttingplane._get_rBigM_obj_and_constraints(
+                    self.instance_rBigM)[1],
+                list(self.instance_rHull.component_data_objects(
+                    Var, descend_into=Block)),
+                self.disaggregated_vars, 2, 0.001, 1e-9, False, 1e-6)
+        return cuts, log.getvalue()
+
+    def check_cut(self, cuts):
+        # x >= 3*Y_0
+        m = self.instance_rBigM
+        self.assertEqual(len(cuts), 1)
+        cut = cuts[0]
+        self.assertEqual(value(cut.args[0]), 0)
+        repn = generate_standard_repn(cut.args[1])
+        self.assertTrue(repn.is_linear())
+        self.assertEqual(len(repn.linear_vars), 2)
+        self.assertIs(repn.linear_vars[0], m.d[0].indicator_var)
+        self.assertEqual(repn.linear_coefs[0], -3)
+        self.assertIs(repn.linear_vars[1], m.x)
+        self.assertEqual(repn.linear_coefs[1], 1)
+
+    def test_potentially_useful_constraints_computed_once(self):
+        self.setup_subproblems()
+        cuts, log = self.create_cuts()
+        self.check_cut(cuts)
+        constraints_for_FME = self.transBlock_rHull.constraints_for_FME
+        # all of the hull constraints except the XOR involve a disaggregated
+        # var
+        self.assertEqual(len(constraints_for_FME), 14)
+
+        cuts, log = self.create_cuts()
+        self.check_cut(cuts)
+        self.assertIs(self.transBlock_rHull.constraints_for_FME,
+                      constraints_for_FME)
+
+    def test_linear_equalities_added_once(self):
+        self.setup_subproblems()
+        for i in range(2):
+            cuts, log = self.create_cuts()
+            self.check_cut(cuts)
+            # The two disaggregation constraints (each only once, though both
+            # of their sides are tight), and the tight sides of the four
+            # inequalities which are tight or violated at xhat.
+            self.assertIn("Calling FME transformation on 6 constraints to "
+                          "eliminate 4 variables", log)
+
+    def test_only_tight_disaggregated_vars_projected(self):
+        self.setup_subproblems()
+        rHull = self.instance_rHull
+        # pretend we have another disaggregated variable, but it only appears
+        # in a constraint that is not tight at xhat.
+        rHull.z = Var()
+        rHull.z.value = 0
+        rHull.not_tight = Constraint(expr=rHull.z + rHull.x <= 100)
+        self.disaggregated_vars.add(rHull.z)
+
+        cuts, log = self.create_cuts()
+        self.check_cut(cuts)
+        self.assertIn("Calling FME transformation on 6 constraints to "
+                      "eliminate 4 variables", log)
+
+    def test_quadratic_disaggregated_var_projected(self):
+        self.setup_subproblems()
+        rHull = self.instance_rHull
+        # pretend we have another disaggregated variable which only appears
+        # quadratically, in a constraint that is tight at xhat.
+        rHull.z = Var()
+        rHull.z.value = 1
+        rHull.tight = Constraint(expr=rHull.z**2 + rHull.x <= 3.5)
+        self.disaggregated_vars.add(rHull.z)
+
+        cuts, log = self.create_cuts()
+        self.check_cut(cuts)
+        self.assertIn(rHull.tight, [cons for cons, var_ids, is_linear in
+                                    self.transBlock_rHull.constraints_for_FME])
+        # We added the linear approximation of the quadratic constraint, and
+        # z is in it, so we project it out too.
+        self.assertIn("Calling FME transformation on 7 constraints to "
+                      "eliminate 5 variables", log)
+
 class Grossmann_TestCases(unittest.TestCase):
     def check_cuts_valid_at_extreme_pts(self, m):
         extreme_points = [
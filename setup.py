@@ -74,6 +74,7 @@ if using_cython:
             "pyomo/repn/plugins/gams_writer.pyx",
             "pyomo/repn/plugins/baron_writer.pyx",
             "pyomo/repn/plugins/ampl/ampl_.pyx",
+            "pyomo/contrib/fme/fourier_motzkin_elimination.pyx",
         ]
         for f in files:
             shutil.copyfile(f[:-1], f)